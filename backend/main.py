@@ -1,4 +1,5 @@
 from fastapi import FastAPI, HTTPException, Depends, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List, Optional, Dict
@@ -6,12 +7,26 @@ import openai
 import os
 from dotenv import load_dotenv
 import json
+import logging
+import time
 from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
 from . import models, auth
 from .database import SessionLocal, engine
+from .utils.prompt_budget import (
+    PromptBudgeter,
+    ModelRouter,
+    DEFAULT_REVIEW_MODEL,
+    DEFAULT_FAST_MODEL,
+    DEFAULT_PROMPT_TOKEN_BUDGET,
+    DEFAULT_FAST_TOKEN_THRESHOLD,
+    CHARS_PER_TOKEN,
+    parse_review_json,
+)
 import uuid
 
+logger = logging.getLogger(__name__)
+
 # Create database tables
 models.Base.metadata.create_all(bind=engine)
 
@@ -37,6 +52,36 @@ app.add_middleware(
 # Initialize OpenAI client
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
+# Prompt budgeting and model routing
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", DEFAULT_PROMPT_TOKEN_BUDGET))
+# Inputs beyond a few prompt budgets are rejected before any minification work
+MAX_REVIEW_INPUT_CHARS = 4 * PROMPT_TOKEN_BUDGET * CHARS_PER_TOKEN
+model_router = ModelRouter(
+    default_model=os.getenv("REVIEW_MODEL", DEFAULT_REVIEW_MODEL),
+    fast_model=os.getenv("REVIEW_FAST_MODEL", DEFAULT_FAST_MODEL),
+    fast_token_threshold=int(os.getenv("FAST_MODEL_TOKEN_THRESHOLD", DEFAULT_FAST_TOKEN_THRESHOLD))
+)
+
+REVIEW_SYSTEM_PROMPT = "You are an expert code reviewer. Provide detailed, constructive feedback."
+
+def request_review(model: str, max_tokens: int, prompt: str):
+    start_time = time.time()
+    response = openai.ChatCompletion.create(
+        model=model,
+        messages=[
+            {"role": "system", "content": REVIEW_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=0.7,
+        max_tokens=max_tokens
+    )
+    latency_ms = (time.time() - start_time) * 1000
+
+    choice = response.choices[0]
+    if choice.finish_reason == "length":
+        return None, latency_ms
+    return parse_review_json(choice.message.content), latency_ms
+
 # Database dependency
 def get_db():
     db = SessionLocal()
@@ -140,51 +185,77 @@ async def review_code(
     db: Session = Depends(get_db)
 ):
     try:
-        # Prepare the prompt for OpenAI
-        prompt = f"""Analyze the following {request.language} code and provide a detailed review:
-        
-        Code:
-        {request.code}
-        
-        Context: {request.context if request.context else 'No additional context provided'}
-        
-        Please provide:
-        1. Code suggestions for improvement
-        2. A clear explanation of the code
-        3. A quality score (0-100)
-        4. Best practices recommendations
-        
-        Format the response as JSON with the following structure:
-        {{
-            "suggestions": ["suggestion1", "suggestion2", ...],
-            "explanation": "detailed explanation",
-            "quality_score": 85.5,
-            "best_practices": ["practice1", "practice2", ...]
-        }}
-        """
-
-        # Call OpenAI API
-        response = openai.ChatCompletion.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": "You are an expert code reviewer. Provide detailed, constructive feedback."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            max_tokens=1000
+        if len(request.code) + len(request.context or '') > MAX_REVIEW_INPUT_CHARS:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Code and context must be at most {MAX_REVIEW_INPUT_CHARS} characters"
+            )
+
+        # Minify and trim code and context to the prompt budget, then pick a model for its size
+        prepared = await run_in_threadpool(
+            PromptBudgeter.prepare, request.code, request.language, PROMPT_TOKEN_BUDGET, request.context
+        )
+        route = model_router.route(prepared, request.code, request.context)
+        first_route = route
+
+        prompt = f"""Review this {request.language} code. Each line is prefixed with its original line number ("N|"); comments and blank lines were removed{' and some lines omitted' if prepared.truncated else ''}. Refer to line numbers in suggestions.
+
+Code:
+{prepared.code}
+
+Context: {prepared.context or 'None'}
+
+Respond with JSON only:
+{{"suggestions": ["..."], "explanation": "...", "quality_score": 0-100, "best_practices": ["..."]}}
+"""
+
+        review_data, latency_ms = request_review(route.model, route.max_tokens, prompt)
+        retry_latency_ms = None
+        if review_data is None and route.tier == "fast":
+            # Cut-off or malformed answer from the fast tier; retry once on the default model
+            logger.warning(f"Fast tier review from {route.model} was incomplete, retrying on default model")
+            route = model_router.escalate()
+            review_data, retry_latency_ms = request_review(route.model, route.max_tokens, prompt)
+        if review_data is None:
+            raise HTTPException(status_code=502, detail="Model returned an incomplete review")
+
+        logger.info(
+            f"Review routed to {route.model} ({route.tier} tier, max_tokens={route.max_tokens}): "
+            f"{prepared.original_tokens} -> {prepared.prompt_tokens} prompt tokens "
+            f"({prepared.tokens_saved} saved, truncated={prepared.truncated}), "
+            f"latency {latency_ms:.0f} ms"
+            + (f" on {first_route.model}, retry {retry_latency_ms:.0f} ms" if retry_latency_ms is not None else "")
         )
 
-        # Parse the response
-        review_data = json.loads(response.choices[0].message.content)
-        
         # Save the review to database
         db_review = models.CodeReview(
             user_id=current_user.id,
             code=request.code,
             language=request.language,
-            review_data=json.dumps(review_data)
+            review_data=json.dumps(review_data),
+            model=route.model
         )
         db.add(db_review)
+        db.flush()
+
+        # Record prompt savings and latency per tier for comparison. Each call is
+        # recorded under the tier that served it, so failed fast attempts stay fast.
+        metrics = {
+            "original_tokens": prepared.original_tokens,
+            "prompt_tokens": prepared.prompt_tokens,
+            "prompt_tokens_saved": prepared.tokens_saved,
+            "max_completion_tokens": first_route.max_tokens,
+            f"latency_ms_{first_route.tier}": latency_ms,
+            "escalated": retry_latency_ms is not None,
+        }
+        if retry_latency_ms is not None:
+            metrics[f"retry_latency_ms_{route.tier}"] = retry_latency_ms
+        for name, value in metrics.items():
+            db.add(models.PerformanceMetric(
+                code_review_id=db_review.id,
+                metric_name=name,
+                metric_value=float(value)
+            ))
         db.commit()
         
         return CodeReviewResponse(
@@ -194,6 +265,8 @@ async def review_code(
             best_practices=review_data["best_practices"]
         )
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -28,6 +28,7 @@ class CodeReview(Base):
     code = Column(Text)
     language = Column(String)
     review_data = Column(Text)  # JSON string of review results
+    model = Column(String, nullable=True)  # LLM that produced the review
     created_at = Column(DateTime, default=datetime.utcnow)
     version = Column(Integer, default=1)
     
@@ -0,0 +1,243 @@
+import random
+import time
+
+from backend.utils.prompt_budget import (
+    MIN_PROMPT_TOKEN_BUDGET,
+    ModelRouter,
+    PreparedPrompt,
+    PromptBudgeter,
+    parse_review_json,
+)
+
+
+def minified_text(code, language):
+    return [text for _, text in PromptBudgeter.minify(code, language)]
+
+
+# minify
+
+def test_minify_keeps_original_line_numbers():
+    code = "# header\n\nx = 1  # set x\n\n\ny = 2\n"
+    assert PromptBudgeter.minify(code, "python") == [(3, "x = 1"), (6, "y = 2")]
+
+
+def test_minify_keeps_block_comment_markers_inside_strings():
+    code = 'const pat = "/*";\nfunction f() {\n  return eval(userInput);\n}\n'
+    assert minified_text(code, "javascript") == [
+        'const pat = "/*";',
+        'function f() {',
+        'return eval(userInput);',
+        '}',
+    ]
+
+
+def test_minify_keeps_glob_patterns_inside_strings():
+    code = 'glob.sync("src/**/*.ts"); // find sources\n'
+    assert minified_text(code, "javascript") == ['glob.sync("src/**/*.ts");']
+
+
+def test_minify_keeps_block_comment_markers_inside_regex_literals():
+    code = "s = s.replace(/\\/*$/, '');\nfunction important() {\n  return 1;\n}\n"
+    assert minified_text(code, "javascript") == [
+        "s = s.replace(/\\/*$/, '');",
+        "function important() {",
+        "return 1;",
+        "}",
+    ]
+
+
+def test_minify_keeps_line_comment_markers_inside_regex_literals():
+    code = "const re = /https?:\\/\\//; // scheme\nx = a / b / c;\n"
+    assert minified_text(code, "typescript") == ["const re = /https?:\\/\\//;", "x = a / b / c;"]
+
+
+def test_minify_falls_back_when_block_comment_never_closes():
+    code = "let a = 1;\n/* unterminated\nimportant();\n"
+    assert PromptBudgeter.minify(code, "javascript") == [
+        (1, "let a = 1;"),
+        (2, "/* unterminated"),
+        (3, "important();"),
+    ]
+
+
+def test_minify_removes_multiline_block_comments():
+    code = "let a = 1; /* start\nstill comment\nend */ let b = 2;\n"
+    assert PromptBudgeter.minify(code, "javascript") == [(1, "let a = 1;"), (3, "let b = 2;")]
+
+
+def test_minify_keeps_hash_inside_python_strings():
+    code = 'url = "http://x/#anchor"  # comment\n'
+    assert minified_text(code, "python") == ['url = "http://x/#anchor"']
+
+
+def test_minify_keeps_comment_markers_inside_multiline_strings():
+    code = 'doc = """\n# not a comment\n"""\nx = 1 # comment\n'
+    assert minified_text(code, "python") == ['doc = """', '# not a comment', '"""', 'x = 1']
+
+
+def test_minify_preserves_two_space_nesting():
+    code = "def f():\n  if x:\n    for y in z:\n      z()\n  w()\n"
+    assert minified_text(code, "python") == [
+        "def f():",
+        " if x:",
+        "  for y in z:",
+        "   z()",
+        " w()",
+    ]
+
+
+def test_minify_preserves_ruby_nesting():
+    code = "def f\n  if x\n    y\n  end\nend\n"
+    assert minified_text(code, "ruby") == ["def f", " if x", "  y", " end", "end"]
+
+
+def test_minify_collapses_whitespace_outside_strings():
+    assert minified_text('a  =   "x   y"', "javascript") == ['a = "x   y"']
+
+
+# fit_to_budget
+
+def test_fit_to_budget_returns_everything_when_it_fits():
+    lines = [(1, "a = 1"), (2, "b = 2")]
+    assert PromptBudgeter.fit_to_budget(lines, 100) == ("1|a = 1\n2|b = 2", False)
+
+
+def test_fit_to_budget_cuts_an_oversized_single_line():
+    lines = [(1, "var data = [" + "1234567, " * 2000 + "];")]
+    prepared, truncated = PromptBudgeter.fit_to_budget(lines, 400)
+    assert truncated
+    assert prepared.startswith("1|var data = [1234567,")
+    assert prepared.endswith("...[line truncated]")
+    assert PromptBudgeter.estimate_tokens(prepared) <= 400
+
+
+def test_fit_to_budget_still_sends_tail_after_huge_first_line():
+    lines = [(1, "x" * 50000)] + [(n, f"call_{n}()") for n in range(2, 6)]
+    prepared, truncated = PromptBudgeter.fit_to_budget(lines, 300)
+    assert truncated
+    assert "5|call_5()" in prepared
+
+
+def test_fit_to_budget_keeps_head_tail_and_outline():
+    lines = []
+    for n in range(1, 401):
+        text = f"def func_{n}():" if n % 50 == 0 else f" value_{n} = compute({n})"
+        lines.append((n, text))
+    prepared, truncated = PromptBudgeter.fit_to_budget(lines, 500)
+    assert truncated
+    assert prepared.startswith("1| value_1 = compute(1)")
+    assert prepared.endswith("400|def func_400():")
+    assert "omitted; outline follows" in prepared
+    assert "200|def func_200():" in prepared
+    assert "201| value_201" not in prepared
+    assert PromptBudgeter.estimate_tokens(prepared) <= 500
+
+
+def test_fit_to_budget_is_a_hard_cap_for_small_budgets():
+    for budget in (50, 100, MIN_PROMPT_TOKEN_BUDGET):
+        for seed in range(20):
+            rng = random.Random(seed)
+            lines = [
+                (n, "".join(rng.choice("ab(),.= ") for _ in range(rng.randint(1, 120))))
+                for n in range(1, rng.randint(2, 800))
+            ]
+            prepared, _ = PromptBudgeter.fit_to_budget(lines, budget)
+            assert PromptBudgeter.estimate_tokens(prepared) <= budget, (budget, seed)
+
+
+# prepare
+
+def test_prepare_counts_context_against_the_budget():
+    prepared = PromptBudgeter.prepare("x = 1\n", "python", 200, context="word " * 5000)
+    assert prepared.truncated
+    assert prepared.context.endswith("...[context truncated]")
+    assert prepared.prompt_tokens <= 200
+
+
+def test_prepare_reports_negative_savings():
+    code = "\n".join(f"a{n}=b{n}" for n in range(200))
+    prepared = PromptBudgeter.prepare(code, "javascript", 10000)
+    assert prepared.tokens_saved == prepared.original_tokens - prepared.prompt_tokens
+    assert prepared.tokens_saved < 0
+
+
+# routing
+
+def route_for(code, context=None, language="javascript"):
+    prepared = PromptBudgeter.prepare(code, language, 6000, context)
+    return ModelRouter().route(prepared, code, context)
+
+
+def test_small_low_risk_input_goes_to_fast_tier():
+    route = route_for("function add(a, b) { return a + b; }")
+    assert route.tier == "fast"
+    assert route.model == "gpt-3.5-turbo"
+    assert route.max_tokens >= 1000
+
+
+def test_large_input_goes_to_default_tier():
+    code = "\n".join(f"let v{n} = add(v{n - 1}, {n});" for n in range(1, 300))
+    assert route_for(code).tier == "default"
+
+
+def test_risk_check_runs_on_raw_code():
+    code = 'const pat = "/*";\nfunction f() {\n  return eval(userInput);\n}\n'
+    assert route_for(code).tier == "default"
+
+
+def test_risk_check_matches_inside_identifiers():
+    for code in (
+        'api_token = "abc"',
+        'db_password = get()',
+        'SECRET_KEY = load()',
+        'const apiToken = read();',
+        'conn.execute(f"SELECT * FROM t WHERE id = {i}")',
+        'run(cmd, shell=True)',
+    ):
+        assert ModelRouter.is_high_risk(code), code
+
+
+def test_risk_check_is_linear_on_repeated_select():
+    start = time.time()
+    assert not ModelRouter.is_high_risk("# " + "select " * 14000)
+    assert time.time() - start < 2
+
+
+def test_risk_check_treats_oversized_input_as_high_risk():
+    assert ModelRouter.is_high_risk("# " + "select " * 30000)
+
+
+def test_risk_check_covers_context():
+    assert route_for("x = 1", context="handles user passwords", language="python").tier == "default"
+
+
+def test_escalate_uses_default_model_with_max_completion():
+    router = ModelRouter()
+    route = router.escalate()
+    assert route.tier == "default"
+    assert route.model == "gpt-4"
+    assert route.max_tokens == router.max_completion_tokens
+
+
+def test_completion_tokens_scale_within_bounds():
+    router = ModelRouter()
+    assert router.completion_tokens(0) == router.min_completion_tokens
+    assert router.completion_tokens(100000) == router.max_completion_tokens
+
+
+def test_tokens_saved_is_signed():
+    prepared = PreparedPrompt(code="", context="", original_tokens=10, prompt_tokens=15, truncated=False)
+    assert prepared.tokens_saved == -5
+
+
+# parse_review_json
+
+def test_parse_review_json_accepts_fenced_json():
+    content = '```json\n{"suggestions": [], "explanation": "ok", "quality_score": 90, "best_practices": []}\n```'
+    assert parse_review_json(content)["quality_score"] == 90
+
+
+def test_parse_review_json_rejects_truncated_or_incomplete_json():
+    assert parse_review_json('{"suggestions": ["a"], "expl') is None
+    assert parse_review_json('{"suggestions": []}') is None
+    assert parse_review_json(None) is None
@@ -0,0 +1,401 @@
+import json
+import re
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+# Rough chars-per-token ratio for code with BPE tokenizers
+CHARS_PER_TOKEN = 4
+
+# Defaults for the review endpoint, overridable through the environment
+DEFAULT_REVIEW_MODEL = "gpt-4"
+DEFAULT_FAST_MODEL = "gpt-3.5-turbo"
+DEFAULT_PROMPT_TOKEN_BUDGET = 6000
+DEFAULT_FAST_TOKEN_THRESHOLD = 800
+
+# Smallest budget fit_to_budget can honour once omission markers are reserved
+MIN_PROMPT_TOKEN_BUDGET = 200
+
+# Longer inputs skip the risk scan and are treated as high risk
+RISK_SCAN_LIMIT = 100000
+
+LINE_COMMENT_MARKERS = {
+    'python': '#',
+    'ruby': '#',
+    'shell': '#',
+    'bash': '#',
+    'javascript': '//',
+    'typescript': '//',
+    'java': '//',
+    'c': '//',
+    'cpp': '//',
+    'csharp': '//',
+    'go': '//',
+    'rust': '//',
+    'kotlin': '//',
+    'swift': '//',
+    'php': '//',
+}
+
+# Languages whose comments are only a line marker (no /* */ blocks)
+HASH_ONLY_LANGUAGES = {'python', 'ruby', 'shell', 'bash'}
+
+# Languages where indentation carries structure and must survive minification
+INDENT_LANGUAGES = {'python', 'ruby', 'shell', 'bash'}
+
+# Languages with /regex/ literals that may contain comment markers
+REGEX_LITERAL_LANGUAGES = {'javascript', 'typescript'}
+
+# A "/" after one of these starts a regex literal rather than a division
+REGEX_PREFIX_PATTERN = re.compile(
+    r'(^|[(,=:\[!&|?{};+\-*%<>~^]|(^|[^\w$])(return|typeof|case|do|else|in|of|void|yield|await|delete|throw|new))$'
+)
+
+# Quotes that may span several lines; any other string ends with its line
+MULTILINE_QUOTES = ('"""', "'''", '`')
+
+# Lines kept from an omitted region so the model still sees the file outline
+OUTLINE_PATTERN = re.compile(
+    r'^\s*(async\s+def|def|class|function|export|public|private|protected|func|fn|impl|interface|struct)\b'
+)
+
+# Inputs touching these always go to the flagship model. Matched as substrings so
+# names like db_password, apiToken or SECRET_KEY are caught too.
+HIGH_RISK_PATTERN = re.compile(
+    r'(eval\s*\(|exec\s*\(|\.execute\s*\(|subprocess|os\.system|os\.popen|shell\s*=\s*True|'
+    r'pickle|marshal|yaml\.load|password|passwd|secret|token|credential|api_?key|private_?key|'
+    r'crypt|jwt|auth|session|cookie|sql|select\s[^;\n]{0,200}?\sfrom|insert\s+into|delete\s+from|'
+    r'innerHTML|dangerouslySetInnerHTML|document\.write|unsafe|deserializ)',
+    re.IGNORECASE
+)
+
+TRUNCATED_LINE_SUFFIX = " ...[line truncated]"
+
+REVIEW_FIELDS = ("suggestions", "explanation", "quality_score", "best_practices")
+
+
+@dataclass
+class PreparedPrompt:
+    code: str
+    context: str
+    original_tokens: int
+    prompt_tokens: int
+    truncated: bool
+
+    @property
+    def tokens_saved(self) -> int:
+        # Negative when line prefixes cost more than minification removed
+        return self.original_tokens - self.prompt_tokens
+
+
+@dataclass
+class ModelRoute:
+    model: str
+    max_tokens: int
+    tier: str
+
+
+class PromptBudgeter:
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        if not text:
+            return 0
+        # Symbols usually become their own tokens, so count them on top of the char ratio
+        symbols = len(re.findall(r'[^\w\s]', text))
+        return (len(text) - symbols) // CHARS_PER_TOKEN + symbols + 1
+
+    @staticmethod
+    def truncate_text(text: str, max_tokens: int, suffix: str = TRUNCATED_LINE_SUFFIX) -> str:
+        if PromptBudgeter.estimate_tokens(text) <= max_tokens:
+            return text
+        limit = max(0, max_tokens - PromptBudgeter.estimate_tokens(suffix))
+        chars = min(len(text), limit * CHARS_PER_TOKEN)
+        while chars > 0 and PromptBudgeter.estimate_tokens(text[:chars]) > limit:
+            chars = chars * limit // PromptBudgeter.estimate_tokens(text[:chars])
+        return text[:chars].rstrip() + suffix
+
+    @staticmethod
+    def _regex_can_start(out: List[str]) -> bool:
+        # Only the last few emitted pieces decide; the "x" stands in for anything earlier
+        window = ('x' if len(out) > 16 else '') + ''.join(out[-16:])
+        return bool(REGEX_PREFIX_PATTERN.search(window.rstrip()))
+
+    @staticmethod
+    def _regex_literal_end(line: str, start: int) -> int:
+        # Index just past the closing "/" of a regex literal, or -1 if the line has none
+        i = start + 1
+        in_class = False
+        while i < len(line):
+            ch = line[i]
+            if ch == '\\':
+                i += 2
+                continue
+            if ch == '[':
+                in_class = True
+            elif ch == ']':
+                in_class = False
+            elif ch == '/' and not in_class:
+                return i + 1
+            i += 1
+        return -1
+
+    @staticmethod
+    def _strip_comments(
+        line: str,
+        marker: Optional[str],
+        block_comments: bool,
+        in_block: bool,
+        quote: Optional[str],
+        regex_literals: bool = False
+    ) -> Tuple[str, bool, Optional[str]]:
+        # Removes comments outside string literals and collapses whitespace runs.
+        # Block comment and multi-line string state is carried across lines.
+        out = []
+        i = 0
+        while i < len(line):
+            if in_block:
+                end = line.find('*/', i)
+                if end == -1:
+                    break
+                in_block = False
+                out.append(' ')
+                i = end + 2
+                continue
+            if quote:
+                if line[i] == '\\':
+                    out.append(line[i:i + 2])
+                    i += 2
+                elif line.startswith(quote, i):
+                    out.append(quote)
+                    i += len(quote)
+                    quote = None
+                else:
+                    out.append(line[i])
+                    i += 1
+                continue
+
+            ch = line[i]
+            opener = next((q for q in MULTILINE_QUOTES if line.startswith(q, i)), None)
+            if opener is None and ch in ('"', "'"):
+                opener = ch
+            if opener:
+                quote = opener
+                out.append(opener)
+                i += len(opener)
+            elif (
+                regex_literals
+                and ch == '/'
+                and not line.startswith(('//', '/*'), i)
+                and PromptBudgeter._regex_can_start(out)
+                and PromptBudgeter._regex_literal_end(line, i) != -1
+            ):
+                end = PromptBudgeter._regex_literal_end(line, i)
+                out.append(line[i:end])
+                i = end
+            elif block_comments and line.startswith('/*', i):
+                in_block = True
+                i += 2
+            elif marker and line.startswith(marker, i):
+                break
+            elif ch in ' \t':
+                if out and out[-1] != ' ':
+                    out.append(' ')
+                i += 1
+            else:
+                out.append(ch)
+                i += 1
+
+        if quote and quote not in MULTILINE_QUOTES:
+            quote = None
+        return ''.join(out), in_block, quote
+
+    @staticmethod
+    def minify(code: str, language: str) -> List[Tuple[int, str]]:
+        # Returns (original line number, minified line) pairs
+        language = (language or '').lower()
+        marker = LINE_COMMENT_MARKERS.get(language)
+        block_comments = marker is not None and language not in HASH_ONLY_LANGUAGES
+        keep_indent = language in INDENT_LANGUAGES
+        regex_literals = language in REGEX_LITERAL_LANGUAGES
+
+        lines = []
+        in_block = False
+        quote = None
+        # Widths of the currently open indentation levels, whatever unit the file uses
+        indent_stack = [0]
+        for number, line in enumerate(code.splitlines(), start=1):
+            starts_in_code = not in_block and not quote
+            text, in_block, quote = PromptBudgeter._strip_comments(
+                line, marker, block_comments, in_block, quote, regex_literals
+            )
+            text = text.strip()
+            if not text:
+                continue
+            if keep_indent:
+                if starts_in_code:
+                    width = len(line.expandtabs(4)) - len(line.expandtabs(4).lstrip())
+                    while width < indent_stack[-1]:
+                        indent_stack.pop()
+                    if width > indent_stack[-1]:
+                        indent_stack.append(width)
+                # One space per nesting level
+                text = ' ' * (len(indent_stack) - 1) + text
+            lines.append((number, text))
+
+        if in_block:
+            # A block comment left open at the end means the scan went wrong somewhere;
+            # send the code with whitespace trimmed rather than drop the rest of the file
+            return [
+                (number, re.sub(r'[ \t]+', ' ', line.strip()))
+                for number, line in enumerate(code.splitlines(), start=1)
+                if line.strip()
+            ]
+        return lines
+
+    @staticmethod
+    def _render(lines: List[Tuple[int, str]]) -> str:
+        return '\n'.join(f"{number}|{text}" for number, text in lines)
+
+    @staticmethod
+    def _omission_markers(first: int, last: int) -> Tuple[str, str]:
+        return (
+            f"... lines {first}-{last} omitted; outline follows ...",
+            f"... end of omitted lines {first}-{last} ...",
+        )
+
+    @staticmethod
+    def fit_to_budget(lines: List[Tuple[int, str]], budget: int) -> Tuple[str, bool]:
+        rendered = PromptBudgeter._render(lines)
+        if PromptBudgeter.estimate_tokens(rendered) <= budget:
+            return rendered, False
+
+        # No single line may take more than a quarter of the budget
+        line_limit = max(budget // 4, PromptBudgeter.estimate_tokens(TRUNCATED_LINE_SUFFIX) + 8)
+        lines = [
+            (number, PromptBudgeter.truncate_text(text, line_limit - len(str(number)) - 1))
+            for number, text in lines
+        ]
+        rendered = PromptBudgeter._render(lines)
+        if PromptBudgeter.estimate_tokens(rendered) <= budget:
+            return rendered, True
+
+        costs = [PromptBudgeter.estimate_tokens(f"{n}|{t}") for n, t in lines]
+        # Reserve the omission markers up front, sized for the largest line number
+        widest = lines[-1][0] if lines else 0
+        marker_cost = sum(
+            PromptBudgeter.estimate_tokens(marker)
+            for marker in PromptBudgeter._omission_markers(widest, widest)
+        )
+        budget = max(0, budget - marker_cost)
+        # Keep a slice of what is left for the outline of the omitted middle
+        remaining = int(budget * 0.8)
+        head, tail = [], []
+        lo, hi = 0, len(lines) - 1
+        head_open, tail_open = True, True
+        # Take lines from the start and end (2:1); once one side no longer fits keep filling the other
+        while lo <= hi and (head_open or tail_open):
+            take_head = head_open and (not tail_open or len(head) <= 2 * len(tail))
+            index = lo if take_head else hi
+            if costs[index] > remaining:
+                if take_head:
+                    head_open = False
+                else:
+                    tail_open = False
+                continue
+            remaining -= costs[index]
+            if take_head:
+                head.append(lines[lo])
+                lo += 1
+            else:
+                tail.insert(0, lines[hi])
+                hi -= 1
+
+        remaining += budget - int(budget * 0.8)
+        outline = []
+        for index in range(lo, hi + 1):
+            number, text = lines[index]
+            if OUTLINE_PATTERN.match(text) and costs[index] <= remaining:
+                remaining -= costs[index]
+                outline.append(lines[index])
+
+        parts = [PromptBudgeter._render(head)] if head else []
+        if lo <= hi:
+            start_marker, end_marker = PromptBudgeter._omission_markers(lines[lo][0], lines[hi][0])
+            parts.append(start_marker)
+            if outline:
+                parts.append(PromptBudgeter._render(outline))
+            parts.append(end_marker)
+        if tail:
+            parts.append(PromptBudgeter._render(tail))
+        return '\n'.join(parts), True
+
+    @staticmethod
+    def prepare(code: str, language: str, budget: int, context: Optional[str] = None) -> PreparedPrompt:
+        context = context or ''
+        budget = max(budget, MIN_PROMPT_TOKEN_BUDGET)
+        original_tokens = PromptBudgeter.estimate_tokens(code) + PromptBudgeter.estimate_tokens(context)
+        # Context shares the budget with the code but may use at most a quarter of it
+        context = re.sub(r'\s+', ' ', context).strip()
+        prepared_context = PromptBudgeter.truncate_text(context, budget // 4, " ...[context truncated]")
+        context_tokens = PromptBudgeter.estimate_tokens(prepared_context)
+        lines = PromptBudgeter.minify(code, language)
+        prepared, truncated = PromptBudgeter.fit_to_budget(lines, budget - context_tokens)
+        return PreparedPrompt(
+            code=prepared,
+            context=prepared_context,
+            original_tokens=original_tokens,
+            prompt_tokens=PromptBudgeter.estimate_tokens(prepared) + context_tokens,
+            truncated=truncated or prepared_context != context
+        )
+
+
+class ModelRouter:
+    def __init__(
+        self,
+        default_model: str = DEFAULT_REVIEW_MODEL,
+        fast_model: str = DEFAULT_FAST_MODEL,
+        fast_token_threshold: int = DEFAULT_FAST_TOKEN_THRESHOLD,
+        min_completion_tokens: int = 1000,
+        max_completion_tokens: int = 2000
+    ):
+        self.default_model = default_model
+        self.fast_model = fast_model
+        self.fast_token_threshold = fast_token_threshold
+        self.min_completion_tokens = min_completion_tokens
+        self.max_completion_tokens = max_completion_tokens
+
+    @staticmethod
+    def is_high_risk(code: str, context: Optional[str] = None) -> bool:
+        if len(code) + len(context or '') > RISK_SCAN_LIMIT:
+            return True
+        return bool(HIGH_RISK_PATTERN.search(code) or (context and HIGH_RISK_PATTERN.search(context)))
+
+    def completion_tokens(self, prompt_tokens: int) -> int:
+        # Review length grows with the input, within fixed bounds
+        return max(self.min_completion_tokens, min(self.max_completion_tokens, 400 + prompt_tokens // 2))
+
+    def route(self, prepared: PreparedPrompt, code: str, context: Optional[str] = None) -> ModelRoute:
+        # The risk check sees the raw input so nothing hidden by minification slips past it
+        max_tokens = self.completion_tokens(prepared.prompt_tokens)
+        if (
+            prepared.prompt_tokens <= self.fast_token_threshold
+            and not prepared.truncated
+            and not self.is_high_risk(code, context)
+        ):
+            return ModelRoute(model=self.fast_model, max_tokens=max_tokens, tier="fast")
+        return ModelRoute(model=self.default_model, max_tokens=max_tokens, tier="default")
+
+    def escalate(self) -> ModelRoute:
+        # Retry target when the fast tier returns a cut-off or unparseable review
+        return ModelRoute(model=self.default_model, max_tokens=self.max_completion_tokens, tier="default")
+
+
+def parse_review_json(content: Optional[str]) -> Optional[dict]:
+    # Models sometimes wrap the JSON in a markdown fence
+    content = re.sub(r'^\s*```(?:json)?\s*|\s*```\s*$', '', content or '')
+    try:
+        review_data = json.loads(content)
+    except ValueError:
+        return None
+    if not isinstance(review_data, dict) or not all(key in review_data for key in REVIEW_FIELDS):
+        return None
+    return review_data